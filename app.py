@@ -1,9 +1,24 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
 import pandas as pd
-import yaml, json, io, zipfile, re
+import yaml, json, io, zipfile, re, os
 from typing import Dict, Any
-from processor import process_all, extract_order_id, parse_xml, split_fixed_by_contract
+from processor import process_all, extract_order_id, parse_xml, split_fixed_by_contract, unified_diff_contexts
+
+try:  # libyaml bindings when available
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
+
+@st.cache_data
+def _load_default_cfg(mtime: float) -> Dict[str, Any]:
+    # mtime is only part of the cache key, so edits to config.yaml are picked up
+    with open("config.yaml", "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=_Loader)
+
+@st.cache_data
+def _dump_cfg(cfg: Dict[str, Any]) -> str:
+    return yaml.dump(cfg, Dumper=_Dumper, allow_unicode=True, sort_keys=False)
 
 st.set_page_config(page_title="PIXID XML Fixer — Multi-Contrats", layout="wide")
 st.title("🔧 PIXID XML Fixer — Multi-Contrats dans un même XML")
@@ -20,13 +35,13 @@ cfg_file = st.file_uploader("⚙️ Configuration (config.yaml)", type=["yaml",
 
 # Config
 if cfg_file:
-    cfg = yaml.safe_load(cfg_file.read())
+    cfg = yaml.load(cfg_file.read(), Loader=_Loader)
 else:
-    cfg = yaml.safe_load(open("config.yaml","r",encoding="utf-8").read())
+    cfg = _load_default_cfg(os.path.getmtime("config.yaml"))
 
 st.subheader("🛠️ Configuration")
-cfg_text = st.text_area("config.yaml (éditable)", value=yaml.safe_dump(cfg, allow_unicode=True, sort_keys=False), height=280)
-cfg = yaml.safe_load(cfg_text) if cfg_text else cfg
+cfg_text = st.text_area("config.yaml (éditable)", value=_dump_cfg(cfg), height=280)
+cfg = yaml.load(cfg_text, Loader=_Loader) if cfg_text else cfg
 
 # Commandes dict
 cmd_records: Dict[str, Dict[str, Any]] = {}
@@ -53,10 +68,10 @@ if cmd_file:
         if "numero_commande" not in df.columns:
             st.warning("Colonne 'numero_commande' absente du CSV.")
         else:
-            for _, row in df.iterrows():
-                key = (row.get("numero_commande") or "").strip()
+            for row in df.fillna("").to_dict(orient="records"):
+                key = row["numero_commande"].strip()
                 if key:
-                    cmd_records[key] = {k:(v.strip() if isinstance(v,str) else v) for k,v in row.to_dict().items()}
+                    cmd_records[key] = {k:(v.strip() if isinstance(v,str) else v) for k,v in row.items()}
 
 if cmd_records:
     st.success(f"{len(cmd_records)} commandes chargées. Ex: {list(cmd_records.keys())[:5]}")
@@ -67,9 +82,10 @@ progress = st.progress(0)
 go = st.button("🚀 Traiter le XML", type="primary", disabled=not xml_file)
 
 if go and xml_file:
-    raw = xml_file.read()
+    # The upload is already an in-memory file object: parse it directly, no bytes copy
+    xml_file.seek(0)
     try:
-        fixed_xml, summaries, diff = process_all(raw, cmd_records, cfg)
+        fixed_xml, summaries, changes = process_all(xml_file, cmd_records, cfg)
     except Exception as e:
         st.error(f"Erreur: {e}")
     else:
@@ -92,17 +108,19 @@ if go and xml_file:
         # Option de split
         if split_opt:
             st.info("Scission en cours…")
-            parts = split_fixed_by_contract(fixed_xml)
+            # Parts are generated one at a time and written straight into the ZIP
+            total = max(1, len(summaries))
             zbuf2 = io.BytesIO()
-            with zipfile.ZipFile(zbuf2, "w", compression=zipfile.ZIP_DEFLATED) as zout2:
-                for k, (order_id, assign_id, xml_part) in enumerate(parts, 1):
-                    fname = f\"{order_id or 'NOORDER'}__{assign_id or 'NOASSIGN'}.xml\"
+            with zipfile.ZipFile(zbuf2, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zout2:
+                for k, (order_id, assign_id, xml_part) in enumerate(split_fixed_by_contract(fixed_xml), 1):
+                    fname = f"{order_id or 'NOORDER'}__{assign_id or 'NOASSIGN'}.xml"
                     zout2.writestr(fname, xml_part)
-                    progress.progress(min(100, int(k*100/max(1,len(parts)))))
+                    progress.progress(min(100, int(k*100/total)))
             zbuf2.seek(0)
-            st.download_button(\"⬇️ Télécharger le ZIP (1 XML / contrat)\", data=zbuf2, file_name=\"split_contracts.zip\", mime=\"application/zip\")
+            st.download_button("⬇️ Télécharger le ZIP (1 XML / contrat)", data=zbuf2, file_name="split_contracts.zip", mime="application/zip")
 
         with st.expander("🧾 Diff complet (avant ↔ après)", expanded=False):
-            st.code(diff or "Aucun changement", language="diff")
+            # Only the modified contracts are diffed
+            st.code(unified_diff_contexts(changes) or "Aucun changement", language="diff")
 
 st.caption("Prend en charge **tous** les contrats contenus dans un même fichier XML (multi-contrats).")
@@ -1,27 +1,89 @@
 # -*- coding: utf-8 -*-
 from lxml import etree
 import re
+import copy
 from io import BytesIO
-from typing import Dict, Any, Tuple, Optional, List
+from functools import lru_cache
+from typing import Dict, Any, Tuple, Optional, List, Union, IO
 
 HR_NS = "http://ns.hr-xml.org/2004-08-02"
 NSMAP = {"hr": HR_NS}
 
+# Clark-notation tags ("{ns}Name"), computed once
+_T: Dict[str, str] = {
+    name: f"{{{HR_NS}}}{name}"
+    for name in (
+        "ReferenceInformation", "OrderId", "IdValue", "AssignmentId", "StaffingCustomerId",
+        "StaffingCustomerOrgUnitId", "AgencyId", "PositionCharacteristics", "PositionLevel",
+        "PositionCoefficient", "PositionStatus", "Code", "ContractInformation",
+        "ContractLegalReason", "RecourseType", "PersonReplaced",
+    )
+}
+
+# Fixed paths, as tag tuples ("{ns}Name") under a contract context.
+_PATHS: Dict[str, Tuple[str, ...]] = {
+    name: tuple(_T[t] for t in tags)
+    for name, tags in {
+        "order_id": ("ReferenceInformation", "OrderId", "IdValue"),
+        "assignment_id": ("ReferenceInformation", "AssignmentId", "IdValue"),
+        "customer_id": ("ReferenceInformation", "StaffingCustomerId", "IdValue"),
+        "org_unit_id": ("ReferenceInformation", "StaffingCustomerOrgUnitId", "IdValue"),
+        "agency_id": ("ReferenceInformation", "AgencyId", "IdValue"),
+        "status_code": ("PositionCharacteristics", "PositionStatus", "Code"),
+        "position_level": ("PositionCharacteristics", "PositionLevel"),
+        "position_coefficient": ("PositionCharacteristics", "PositionCoefficient"),
+        "person_replaced": ("ContractInformation", "ContractLegalReason", "PersonReplaced"),
+        "recourse_type": ("ContractInformation", "ContractLegalReason", "RecourseType"),
+    }.items()
+}
+
+PathLike = Union[str, Tuple[str, ...], etree.XPath]
+
+DEFAULT_CLASS_REGEX = r"^[A-E]\d{1,2}$"
+
+@lru_cache(maxsize=32)
+def _get_class_re(pattern: str) -> "re.Pattern[str]":
+    # The pattern is editable in the config: bounded cache
+    return re.compile(pattern)
+
+_get_class_re(DEFAULT_CLASS_REGEX)  # compiled at import
+
 # ---------------- Core XML helpers ----------------
-def parse_xml(xml_bytes: bytes) -> etree._ElementTree:
-    parser = etree.XMLParser(remove_blank_text=True, recover=True)
-    return etree.parse(BytesIO(xml_bytes), parser)
+XmlSource = Union[bytes, str, IO[bytes]]
 
-def tostring(tree: etree._ElementTree) -> bytes:
-    return etree.tostring(tree, encoding="utf-8", pretty_print=True, xml_declaration=True)
+def parse_xml(source: XmlSource) -> etree._ElementTree:
+    """Bytes are wrapped in BytesIO; a path or file-like object (upload, mmap) is parsed as is."""
+    # Blank text is still dropped: pretty_print only re-indents trees without it.
+    # No xml:id lookup table is needed, and large exports must not hit libxml2's size limits.
+    parser = etree.XMLParser(remove_blank_text=True, recover=True, collect_ids=False, huge_tree=True)
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    return etree.parse(source, parser)
 
-def unified_diff_bytes(before: bytes, after: bytes) -> str:
+def tostring(tree: Union[etree._ElementTree, etree._Element], pretty: bool = True) -> bytes:
+    return etree.tostring(tree, encoding="utf-8", pretty_print=pretty, xml_declaration=True)
+
+def unified_diff_bytes(before: bytes, after: bytes, fromfile: str = "before.xml", tofile: str = "after.xml") -> str:
     import difflib
     a = before.decode("utf-8", errors="ignore").splitlines(keepends=False)
     b = after.decode("utf-8", errors="ignore").splitlines(keepends=False)
-    diff = difflib.unified_diff(a, b, fromfile="before.xml", tofile="after.xml", lineterm="")
+    diff = difflib.unified_diff(a, b, fromfile=fromfile, tofile=tofile, lineterm="")
     return "\n".join(diff)
 
+def unified_diff_contexts(changes: List[Tuple[str, bytes, bytes]]) -> str:
+    """Whole-doc diff composed from the per-contract (order_id, before, after) snapshots."""
+    return "\n".join(
+        unified_diff_bytes(_pretty(before), _pretty(after), fromfile=f"{order_id or 'NOORDER'}/before.xml", tofile=f"{order_id or 'NOORDER'}/after.xml")
+        for order_id, before, after in changes
+    )
+
+def _ctx_bytes(ctx: etree._Element) -> bytes:
+    """Compact snapshot of a contract; only used for comparison, pretty-printed on demand."""
+    return etree.tostring(ctx, encoding="utf-8", with_tail=False)
+
+def _pretty(snapshot: bytes) -> bytes:
+    return etree.tostring(parse_xml(snapshot).getroot(), encoding="utf-8", pretty_print=True)
+
 # -------------- CONTEXT-AWARE (per-contract) helpers --------------
 def _rel(xpath: str) -> str:
     """Make an xpath relative to a context element."""
@@ -32,59 +94,128 @@ def _rel(xpath: str) -> str:
         return ".//" + xp
     return xp
 
-def find_one_rel(ctx: etree._Element, xpath: str) -> Optional[etree._Element]:
-    nodes = ctx.xpath(_rel(xpath), namespaces=NSMAP)
-    return nodes[0] if nodes else None
+# 'hr:Name' is in the HR-XML namespace; a bare 'Name' has no namespace, as in XPath
+_STEP_RE = re.compile(r"(hr:)?([A-Za-z_][\w.\-]*)$")
 
-def get_text_rel(ctx: etree._Element, xpath: str) -> str:
-    node = find_one_rel(ctx, xpath)
+@lru_cache(maxsize=256)
+def _path_tags(xpath: str) -> Optional[Tuple[str, ...]]:
+    """
+    Split a simple 'hr:A/hr:B/...' path (optional leading '//' or './/') into Clark tags.
+    Unprefixed steps map to un-namespaced tags.
+    Returns None for anything else (predicates, axes, other prefixes).
+    """
+    xp = xpath.strip()
+    for lead in (".//", "//"):
+        if xp.startswith(lead):
+            xp = xp[len(lead):]
+            break
+    tags = []
+    for step in xp.split("/"):
+        m = _STEP_RE.match(step)
+        if not m:
+            return None
+        name = m.group(2)
+        tags.append((_T.get(name) or f"{{{HR_NS}}}{name}") if m.group(1) else name)
+    return tuple(tags)
+
+def _as_tags(path: PathLike) -> Optional[Tuple[str, ...]]:
+    if isinstance(path, tuple):
+        return path
+    return _path_tags(path.path if isinstance(path, etree.XPath) else path)
+
+def _scan_paths(ctx: etree._Element, targets: Dict[str, Tuple[str, ...]]) -> Dict[str, etree._Element]:
+    """
+    Resolve several paths in one walk: for each key, the first element (document order)
+    matching './/hr:A/hr:B/...' of its tag tuple. Keys with no match are absent.
+    """
+    by_last: Dict[str, List[Tuple[str, Tuple[str, ...]]]] = {}
+    for key, tags in targets.items():
+        by_last.setdefault(tags[-1], []).append((key, tags))
+    found: Dict[str, etree._Element] = {}
+    stack: List[Optional[str]] = []  # tags from ctx (excluded) down to the current element
+    for event, el in etree.iterwalk(ctx, events=("start", "end")):
+        if event == "end":
+            stack.pop()
+            continue
+        tag = el.tag
+        # ctx itself never matches the first step, hence the placeholder
+        stack.append(tag if stack else None)
+        for key, tags in by_last.get(tag, ()):
+            if key not in found and len(tags) < len(stack) and tuple(stack[-len(tags):]) == tags:
+                found[key] = el
+        if len(found) == len(targets):
+            break
+    return found
+
+def _find_path(ctx: etree._Element, tags: Tuple[str, ...]) -> Optional[etree._Element]:
+    """First element matching './/hr:A/hr:B/...' of the tag tuple, in document order."""
+    return _scan_paths(ctx, {"": tags}).get("")
+
+def _text(node: Optional[etree._Element]) -> str:
     return (node.text or "").strip() if node is not None and node.text is not None else ""
 
-def ensure_node_rel(ctx: etree._Element, xpath: str) -> etree._Element:
+def find_one_rel(ctx: etree._Element, xpath: PathLike) -> Optional[etree._Element]:
+    """
+    Accepts a tuple of Clark tags, a precompiled etree.XPath, or a string.
+    Simple paths are resolved by tree traversal; other strings fall back to XPath.
+    """
+    tags = _as_tags(xpath)
+    if tags:
+        return _find_path(ctx, tags)
+    if isinstance(xpath, etree.XPath):
+        nodes = xpath(ctx)
+    else:
+        nodes = ctx.xpath(_rel(xpath), namespaces=NSMAP)
+    return nodes[0] if nodes else None
+
+def get_text_rel(ctx: etree._Element, xpath: PathLike) -> str:
+    return _text(find_one_rel(ctx, xpath))
+
+def ensure_node_rel(ctx: etree._Element, xpath: PathLike) -> etree._Element:
     """
     Creates the node path under the given context element.
-    Supports simple paths like hr:Parent/hr:Child/... with an optional leading '//' or './/'.
+    Supports simple paths like hr:Parent/hr:Child/... with an optional leading '//' or './/',
+    or the equivalent tuple of Clark tags.
     """
-    # Normalize path and split
-    xp = _rel(xpath)
-    parts = [p for p in xp.replace(".//", "").split("/") if p]
-    # Try to find the final node directly
-    node = find_one_rel(ctx, xpath)
-    if node is not None:
-        return node
-
-    # Walk & create under context
-    parent = ctx
-    for i, p in enumerate(parts):
-        # find existing child matching the path prefix
-        subxp = ".//" + "/".join(parts[:i+1])
-        found = ctx.xpath(subxp, namespaces=NSMAP)
-        if found:
-            parent = found[0]
-            continue
-        # create the missing element
-        tag = p.replace("hr:", "{%s}" % HR_NS)
-        new_el = etree.Element(tag)
-        parent.append(new_el)
-        parent = new_el
-    return parent
-
-def set_text_rel(ctx: etree._Element, xpath: str, value: str) -> None:
+    parts = _as_tags(xpath)
+    xp = xpath.path if isinstance(xpath, etree.XPath) else xpath
+    if not parts and isinstance(xp, str):
+        # As before: a '//' inside the path creates plain child steps
+        parts = _path_tags("/".join(p for p in xp.split("/") if p and p != "."))
+    if not parts:
+        raise ValueError(f"Cannot create nodes for non-simple path: {xpath!r}")
+    # Deepest path prefix that exists anywhere under the context (first match in
+    # document order), as before; a single walk resolves every prefix. A prefix can
+    # only match below a match of the shorter one, so the found ones are consecutive.
+    found = _scan_paths(ctx, {str(i): parts[:i + 1] for i in range(len(parts))})
+    node = ctx
+    depth = 0
+    while str(depth) in found:
+        node = found[str(depth)]
+        depth += 1
+    # Create the rest below it
+    for tag in parts[depth:]:
+        node = etree.SubElement(node, tag)
+    return node
+
+def set_text_rel(ctx: etree._Element, xpath: PathLike, value: str) -> None:
     node = find_one_rel(ctx, xpath)
     if node is None:
         node = ensure_node_rel(ctx, xpath)
     node.text = value
 
 # -------------- Discovery of "contract" contexts --------------
+_CONTRACT_CTX_XP = etree.XPath(
+    "//hr:ReferenceInformation[hr:OrderId/hr:IdValue and hr:AssignmentId/hr:IdValue]/parent::*",
+    namespaces=NSMAP,
+)
+
 def find_contract_contexts(tree: etree._ElementTree) -> List[etree._Element]:
     """
     Heuristic: a 'contract' context is any element that contains a <ReferenceInformation>
     with BOTH <OrderId><IdValue> and <AssignmentId><IdValue> below it.
     """
-    parents = tree.xpath(
-        "//hr:ReferenceInformation[hr:OrderId/hr:IdValue and hr:AssignmentId/hr:IdValue]/..",
-        namespaces=NSMAP
-    )
+    parents = _CONTRACT_CTX_XP(tree)
     # Deduplicate while preserving order
     seen = set()
     result = []
@@ -95,84 +226,111 @@ def find_contract_contexts(tree: etree._ElementTree) -> List[etree._Element]:
     return result
 
 # -------------- Single-context operations --------------
+_MAPPING_KEYS = ("classification_interimaire", "statut", "personne_absente", "code_metier", "code_site")
+
 def extract_order_id_ctx(ctx: etree._Element) -> str:
-    return get_text_rel(ctx, "//hr:ReferenceInformation/hr:OrderId/hr:IdValue")
+    return _text(_find_path(ctx, _PATHS["order_id"]))
 
 def extract_assignment_id_ctx(ctx: etree._Element) -> str:
-    return get_text_rel(ctx, "//hr:ReferenceInformation/hr:AssignmentId/hr:IdValue")
-
-def normalize_classification_ctx(ctx: etree._Element, class_regex: str = r"^[A-E]\d{1,2}$") -> Tuple[bool, str]:
-    coeff_xp = "//hr:PositionCharacteristics/hr:PositionCoefficient"
-    level_xp = "//hr:PositionCharacteristics/hr:PositionLevel"
-    coeff = get_text_rel(ctx, coeff_xp)
-    level = get_text_rel(ctx, level_xp)
-    if not coeff and re.match(class_regex, level or ""):
-        set_text_rel(ctx, coeff_xp, level)
+    return _text(_find_path(ctx, _PATHS["assignment_id"]))
+
+def normalize_classification_ctx(ctx: etree._Element, class_regex: str = DEFAULT_CLASS_REGEX) -> Tuple[bool, str]:
+    coeff = get_text_rel(ctx, _PATHS["position_coefficient"])
+    level = get_text_rel(ctx, _PATHS["position_level"])
+    if not coeff and _get_class_re(class_regex).match(level or ""):
+        set_text_rel(ctx, _PATHS["position_coefficient"], level)
         return True, level
     return False, coeff or ""
 
+CompiledPath = Union[Tuple[str, ...], etree.XPath]
+
+@lru_cache(maxsize=64)
+def _compile_path(xpath: str) -> CompiledPath:
+    """A mapping path: tag tuple when simple, compiled etree.XPath otherwise."""
+    return _path_tags(xpath) or etree.XPath(_rel(xpath), namespaces=NSMAP)
+
 def apply_command_mappings_ctx(ctx: etree._Element, cmd: Dict[str, Any], cfg: Dict[str, Any]) -> Dict[str, Any]:
     applied = {}
-    mappings: Dict[str, str] = cfg.get("mappings", {})
+    mappings: Dict[str, str] = {k: v for k, v in (cfg.get("mappings") or {}).items() if isinstance(v, str)}
     statut_map: Dict[str, str] = cfg.get("statut_map", {})
 
-    if "classification_interimaire" in cmd and "classification_interimaire" in mappings:
-        value = str(cmd["classification_interimaire"]).strip()
-        if value:
-            set_text_rel(ctx, mappings["classification_interimaire"], value)
-            applied["classification_interimaire"] = value
-
-    if "statut" in cmd and "statut" in mappings:
-        raw = str(cmd["statut"]).strip()
-        value = statut_map.get(raw, raw) if raw else ""
-        if value:
-            set_text_rel(ctx, mappings["statut"], value)
-            applied["statut"] = value
-
-    if "personne_absente" in cmd and "personne_absente" in mappings:
-        value = str(cmd["personne_absente"]).strip()
-        if value:
-            set_text_rel(ctx, mappings["personne_absente"], value)
-            set_text_rel(ctx, "//hr:ContractInformation/hr:ContractLegalReason/hr:RecourseType", "01")
-            applied["personne_absente"] = value
-            applied["recourse_type"] = "01"
-
-    if "code_metier" in cmd and "code_metier" in mappings:
-        value = str(cmd["code_metier"]).strip()
-        if value:
-            set_text_rel(ctx, mappings["code_metier"], value)
-            applied["code_metier"] = value
-
-    if "code_site" in cmd and "code_site" in mappings:
-        value = str(cmd["code_site"]).strip()
-        if value:
-            curr = get_text_rel(ctx, mappings["code_site"])
-            site_cfg = cfg.get("site_idvalue", {})
-            rebuild = site_cfg.get("rebuild", False)
-            if rebuild and site_cfg.get("siret_prefix"):
-                set_text_rel(ctx, mappings["code_site"], f"{site_cfg['siret_prefix']}-{value}")
+    # Values this command writes; only their paths are compiled (cached per path string)
+    values: Dict[str, str] = {}
+    for key in _MAPPING_KEYS:
+        if key in cmd and key in mappings:
+            value = str(cmd[key]).strip()
+            if key == "statut" and value:
+                value = statut_map.get(value, value)
+            if value:
+                values[key] = value
+    paths: Dict[str, PathLike] = {key: _compile_path(mappings[key]) for key in values}
+
+    # Locate every existing target in a single walk over the context
+    targets = {key: p for key, p in paths.items() if isinstance(p, tuple)}
+    if "personne_absente" in targets:
+        targets["recourse_type"] = _PATHS["recourse_type"]
+    found = _scan_paths(ctx, targets) if targets else {}
+
+    def write(key: str, path: PathLike, value: str) -> None:
+        node = found.get(key)
+        if node is None:
+            # Missing (created here) or not a simple path. Nodes created here can
+            # precede the ones found above: the next writes look their path up again
+            found.clear()
+            set_text_rel(ctx, path, value)
+        else:
+            node.text = value
+
+    for key in ("classification_interimaire", "statut"):
+        if key in values:
+            write(key, paths[key], values[key])
+            applied[key] = values[key]
+
+    if "personne_absente" in values:
+        value = values["personne_absente"]
+        write("personne_absente", paths["personne_absente"], value)
+        write("recourse_type", _PATHS["recourse_type"], "01")
+        applied["personne_absente"] = value
+        applied["recourse_type"] = "01"
+
+    if "code_metier" in values:
+        write("code_metier", paths["code_metier"], values["code_metier"])
+        applied["code_metier"] = values["code_metier"]
+
+    if "code_site" in values:
+        value = values["code_site"]
+        path = paths["code_site"]
+        curr = _text(found["code_site"]) if "code_site" in found else get_text_rel(ctx, path)
+        site_cfg = cfg.get("site_idvalue", {})
+        rebuild = site_cfg.get("rebuild", False)
+        if rebuild and site_cfg.get("siret_prefix"):
+            write("code_site", path, f"{site_cfg['siret_prefix']}-{value}")
+        else:
+            if curr and "-" in curr:
+                prefix = curr.split("-")[0]
+                write("code_site", path, f"{prefix}-{value}")
             else:
-                if curr and "-" in curr:
-                    prefix = curr.split("-")[0]
-                    set_text_rel(ctx, mappings["code_site"], f"{prefix}-{value}")
-                else:
-                    set_text_rel(ctx, mappings["code_site"], value)
-            applied["code_site"] = value
+                write("code_site", path, value)
+        applied["code_site"] = value
 
     return applied
 
+_SUMMARY_PATHS: Dict[str, Tuple[str, ...]] = {
+    "OrderId": _PATHS["order_id"],
+    "AssignmentId": _PATHS["assignment_id"],
+    "EU": _PATHS["customer_id"],
+    "OrgUnit": _PATHS["org_unit_id"],
+    "Agency": _PATHS["agency_id"],
+    "StatusCode": _PATHS["status_code"],
+    "PositionLevel": _PATHS["position_level"],
+    "PositionCoefficient": _PATHS["position_coefficient"],
+    "PersonReplaced": _PATHS["person_replaced"],
+}
+
 def summarize_ctx(ctx: etree._Element) -> Dict[str, Any]:
-    return {
-        "OrderId": extract_order_id_ctx(ctx),
-        "AssignmentId": extract_assignment_id_ctx(ctx),
-        "EU": get_text_rel(ctx, "//hr:ReferenceInformation/hr:StaffingCustomerId/hr:IdValue"),
-        "OrgUnit": get_text_rel(ctx, "//hr:ReferenceInformation/hr:StaffingCustomerOrgUnitId/hr:IdValue"),
-        "Agency": get_text_rel(ctx, "//hr:ReferenceInformation/hr:AgencyId/hr:IdValue"),
-        "StatusCode": get_text_rel(ctx, "//hr:PositionCharacteristics/hr:PositionStatus/hr:Code"),
-        "PositionLevel": get_text_rel(ctx, "//hr:PositionCharacteristics/hr:PositionLevel"),
-        "PositionCoefficient": get_text_rel(ctx, "//hr:PositionCharacteristics/hr:PositionCoefficient"),
-        "PersonReplaced": get_text_rel(ctx, "//hr:ContractInformation/hr:ContractLegalReason/hr:PersonReplaced"),
-    }
+    # All summary fields in one walk over the context
+    found = _scan_paths(ctx, _SUMMARY_PATHS)
+    return {key: _text(found.get(key)) for key in _SUMMARY_PATHS}
 
 # -------------- Public APIs --------------
 def extract_order_id(tree: etree._ElementTree) -> str:
@@ -182,7 +340,7 @@ def extract_order_id(tree: etree._ElementTree) -> str:
     contexts = find_contract_contexts(tree)
     return extract_order_id_ctx(contexts[0]) if contexts else ""
 
-def process_one(xml_bytes: bytes, cmd_row: Optional[Dict[str, Any]], cfg: Dict[str, Any]):
+def process_one(xml_bytes: XmlSource, cmd_row: Optional[Dict[str, Any]], cfg: Dict[str, Any]):
     """
     Backward-compatible single-context processing (first contract only).
     """
@@ -196,65 +354,114 @@ def process_one(xml_bytes: bytes, cmd_row: Optional[Dict[str, Any]], cfg: Dict[s
     ctx = contexts[0]
     rules = cfg.get("rules", {})
     if rules.get("normalize_coefficient_from_level", True):
-        normalize_classification_ctx(ctx, rules.get("classification_regex", r"^[A-E]\d{1,2}$"))
+        normalize_classification_ctx(ctx, rules.get("classification_regex", DEFAULT_CLASS_REGEX))
     if cmd_row:
         apply_command_mappings_ctx(ctx, cmd_row, cfg)
     after = tostring(tree)
     summary = summarize_ctx(ctx)
     return after, summary, unified_diff_bytes(before, after)
 
-def process_all(xml_bytes: bytes, cmd_records: Dict[str, Dict[str, Any]], cfg: Dict[str, Any]):
+def process_all(xml_bytes: XmlSource, cmd_records: Dict[str, Dict[str, Any]], cfg: Dict[str, Any],
+                return_summaries: bool = True):
     """
     Process ALL contracts within a single XML document.
-    Returns (xml_fixed, summaries_list, diff_whole_doc).
+    Returns (xml_fixed, summaries_list, changes) where changes lists
+    (order_id, before, after) for every modified contract; see unified_diff_contexts.
+    summaries_list is empty when return_summaries is False.
     """
     tree = parse_xml(xml_bytes)
-    before = tostring(tree)
     contexts = find_contract_contexts(tree)
     summaries: List[Dict[str, Any]] = []
+    changes: List[Tuple[str, bytes, bytes]] = []
 
     rules = cfg.get("rules", {})
+    normalize = rules.get("normalize_coefficient_from_level", True)
+    if not normalize and not cmd_records:
+        # Nothing can change: no per-contract work besides the summaries
+        if return_summaries:
+            for ctx in contexts:
+                s = summarize_ctx(ctx)
+                s["matched"] = False
+                summaries.append(s)
+        return tostring(tree), summaries, changes
+
     for ctx in contexts:
-        # Normalize
-        if rules.get("normalize_coefficient_from_level", True):
-            normalize_classification_ctx(ctx, rules.get("classification_regex", r"^[A-E]\d{1,2}$"))
         # Match command row by OrderId
         key = extract_order_id_ctx(ctx)
         cmd_row = cmd_records.get(key) if key else None
+        # Snapshot only contracts that may be modified
+        before = _ctx_bytes(ctx) if normalize or cmd_row else None
+        # Normalize
+        if normalize:
+            normalize_classification_ctx(ctx, rules.get("classification_regex", DEFAULT_CLASS_REGEX))
         if cmd_row:
             apply_command_mappings_ctx(ctx, cmd_row, cfg)
-        s = summarize_ctx(ctx)
-        s["matched"] = bool(cmd_row)
-        summaries.append(s)
+        if before is not None:
+            after_ctx = _ctx_bytes(ctx)
+            if after_ctx != before:
+                changes.append((key, before, after_ctx))
+        if return_summaries:
+            s = summarize_ctx(ctx)
+            s["matched"] = bool(cmd_row)
+            summaries.append(s)
 
     after = tostring(tree)
-    diff = unified_diff_bytes(before, after)
-    return after, summaries, diff
+    return after, summaries, changes
+
 
+def _child_index_path(el: etree._Element) -> Tuple[int, ...]:
+    """Child indexes leading from the root element down to el."""
+    path = []
+    parent = el.getparent()
+    while parent is not None:
+        path.append(parent.index(el))
+        el, parent = parent, parent.getparent()
+    return tuple(reversed(path))
 
 def split_fixed_by_contract(fixed_xml_bytes: bytes):
     """
     Reparse the already fixed XML and split into N XML files,
     each containing exactly one contract context.
-    Returns: List[ (order_id, assignment_id, bytes_xml) ]
+    Yields: (order_id, assignment_id, bytes_xml), one part at a time.
     """
     tree = parse_xml(fixed_xml_bytes)
+    root = tree.getroot()
     contexts = find_contract_contexts(tree)
-    results = []
+    # A root that is a contract itself stays in every part and gives its ids, as before
+    root_is_ctx = bool(contexts) and contexts[0] is root
+    inner = contexts[1:] if root_is_ctx else contexts
+    if root_is_ctx and not inner:
+        # The root is the only contract: nothing to split off
+        yield extract_order_id_ctx(root) or "NOORDER_001", extract_assignment_id_ctx(root) or "NOASSIGN_001", tostring(root)
+        return
+    # Slot of each contract among its parent's non-contract children
+    slots: Dict[int, Tuple[etree._Element, int]] = {}
+    before_in_parent: Dict[int, int] = {}
+    for ctx in inner:
+        parent = ctx.getparent()
+        rank = before_in_parent.get(id(parent), 0)
+        before_in_parent[id(parent)] = rank + 1
+        slots[id(ctx)] = (parent, parent.index(ctx) - rank)
+    # Detach the contracts once: what remains is the skeleton shared by every part
+    for ctx in inner:
+        ctx.getparent().remove(ctx)
+    # A contract nested in another one has no slot in the skeleton: like before, it is
+    # removed along with the enclosing contract
+    parent_paths = {
+        id(parent): _child_index_path(parent) if parent is root or root in parent.iterancestors() else None
+        for parent, _ in slots.values()
+    }
     for i, ctx in enumerate(contexts):
-        # Deep copy the whole doc
-        root_copy = etree.fromstring(etree.tostring(tree.getroot()))
-        tree_copy = etree.ElementTree(root_copy)
-        # Find contexts in the copy (same order)
-        ctxs_copy = find_contract_contexts(tree_copy)
-        for j, ctx_copy in enumerate(ctxs_copy):
-            if j != i:
-                parent = ctx_copy.getparent()
-                if parent is not None:
-                    parent.remove(ctx_copy)
-        # Extract keys from the kept context
-        kept_ctx = find_contract_contexts(tree_copy)[0]
+        part_root = copy.deepcopy(root)
+        if id(ctx) in slots:
+            parent, idx = slots[id(ctx)]
+            path = parent_paths[id(parent)]
+            if path is not None:
+                part_parent = part_root
+                for k in path:
+                    part_parent = part_parent[k]
+                part_parent.insert(idx, copy.deepcopy(ctx))
+        kept_ctx = part_root if root_is_ctx else ctx
         order_id = extract_order_id_ctx(kept_ctx) or f"NOORDER_{i+1:03d}"
         assign_id = extract_assignment_id_ctx(kept_ctx) or f"NOASSIGN_{i+1:03d}"
-        results.append((order_id, assign_id, tostring(tree_copy)))
-    return results
+        yield order_id, assign_id, tostring(part_root)
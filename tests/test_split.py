@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from lxml import etree
+
+from processor import (
+    HR_NS, extract_assignment_id_ctx, extract_order_id_ctx, find_contract_contexts,
+    parse_xml, split_fixed_by_contract, tostring,
+)
+
+def _ref(order_id: str, assign_id: str) -> str:
+    return (f"<ReferenceInformation><OrderId><IdValue>{order_id}</IdValue></OrderId>"
+            f"<AssignmentId><IdValue>{assign_id}</IdValue></AssignmentId></ReferenceInformation>")
+
+# The root carries its own ReferenceInformation, so it is a contract context too
+ROOT_AND_TWO_CONTRACTS = (
+    f'<Envelope xmlns="{HR_NS}"><Header/>{_ref("R", "RA")}'
+    f'<C>{_ref("O1", "A1")}</C><Packet><C>{_ref("O2", "A2")}</C></Packet></Envelope>'
+).encode()
+
+def _copy_and_remove(fixed_xml_bytes: bytes):
+    """Reference split: copy the whole document and remove every other contract."""
+    tree = parse_xml(fixed_xml_bytes)
+    parts = []
+    for i in range(len(find_contract_contexts(tree))):
+        tree_copy = etree.ElementTree(etree.fromstring(etree.tostring(tree.getroot())))
+        for j, ctx in enumerate(find_contract_contexts(tree_copy)):
+            if j != i and ctx.getparent() is not None:
+                ctx.getparent().remove(ctx)
+        kept_ctx = find_contract_contexts(tree_copy)[0]
+        parts.append((extract_order_id_ctx(kept_ctx) or f"NOORDER_{i+1:03d}",
+                      extract_assignment_id_ctx(kept_ctx) or f"NOASSIGN_{i+1:03d}",
+                      tostring(tree_copy)))
+    return parts
+
+def _order_ids(xml_part: bytes):
+    return [el.text for el in etree.fromstring(xml_part).iter(f"{{{HR_NS}}}IdValue")
+            if el.getparent().tag == f"{{{HR_NS}}}OrderId"]
+
+def test_split_root_contract_with_other_contracts():
+    parts = list(split_fixed_by_contract(ROOT_AND_TWO_CONTRACTS))
+    assert parts == _copy_and_remove(ROOT_AND_TWO_CONTRACTS)
+    # Root only, then root plus one contract each
+    assert [_order_ids(xml_part) for _, _, xml_part in parts] == [["R"], ["R", "O1"], ["R", "O2"]]
+
+def test_split_root_only_contract():
+    xml = f'<Envelope xmlns="{HR_NS}">{_ref("R", "RA")}</Envelope>'.encode()
+    assert list(split_fixed_by_contract(xml)) == _copy_and_remove(xml)
+
+def test_split_contracts_under_wrappers():
+    xml = (f'<Envelope xmlns="{HR_NS}"><Header/><Packet><C>{_ref("O1", "A1")}</C><Note/>'
+           f'<C>{_ref("O2", "A2")}</C></Packet><Packet><C>{_ref("O3", "A3")}</C></Packet></Envelope>').encode()
+    parts = list(split_fixed_by_contract(xml))
+    assert parts == _copy_and_remove(xml)
+    assert [(order_id, assign_id) for order_id, assign_id, _ in parts] == [("O1", "A1"), ("O2", "A2"), ("O3", "A3")]